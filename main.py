@@ -1,15 +1,24 @@
 import os
 import asyncio
+import functools
 import logging
 import hashlib
 import json
-import traceback
+import xxhash
 import aiohttp
 from datetime import datetime, timedelta
-from bs4 import BeautifulSoup
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+from selectolax.lexbor import LexborHTMLParser
 import telegram
 from telegram.ext import ApplicationBuilder, CommandHandler
+from aiolimiter import AsyncLimiter
 import random
+import re
+import signal
+import sqlite3
+import time
+from dataclasses import dataclass, field
 
 # Configure logging
 logging.basicConfig(
@@ -20,10 +29,18 @@ logger = logging.getLogger(__name__)
 
 # Bot configuration (set these as environment variables)
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
+# Have python-telegram-bot report time periods such as RetryAfter.retry_after as timedelta
+# instead of deprecated ints, which warn on every access
+os.environ.setdefault("PTB_TIMEDELTA", "true")
 NEWS_CHECK_INTERVAL = 3600  # Check for news every hour (in seconds)
+MAX_POSTS_PER_CHECK = 5  # Maximum number of headlines posted per check
+HOST_FAILURE_LIMIT = 5  # Consecutive failed requests before a site is skipped for one check
+MAX_TITLE_LENGTH = 200  # Longer text found around a bare link is cut to this length
 
-# File to store posted news to avoid duplicates
-POSTED_NEWS_FILE = "posted_news.json"
+# Database of posted news to avoid duplicates
+POSTED_NEWS_DB = "posted_news.db"
+# Previous JSON file keyed by MD5, imported into the database on first start
+LEGACY_POSTED_NEWS_FILE = "posted_news.json"
 
 # Common User-Agent strings to rotate for anti-blocking
 USER_AGENTS = [
@@ -34,214 +51,263 @@ USER_AGENTS = [
     'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:123.0) Gecko/20100101 Firefox/123.0'
 ]
 
+# Browser-like headers set once on the shared session
+BASE_HEADERS = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Sec-Fetch-User': '?1',
+    'Cache-Control': 'max-age=0'
+}
+
+# Per-request User-Agent overrides, merged by aiohttp over the session headers
+USER_AGENT_HEADERS = tuple({'User-Agent': ua} for ua in USER_AGENTS)
+
+# Grouped CSS selectors for the title/link elements inside an article card
+TITLE_SEL = 'h1, h2, h3, h4, h5, h6, .headline, .title, .card-title, [data-testid="title"]'
+COINTELEGRAPH_TITLE_SEL = '.post-card-inline__title, .post-card__title, h1, h2, h3, h4, .title, .headline'
+HEADING_SEL = 'h1, h2, h3, h4, h5, h6, .title, .heading'
+LINK_SEL = 'a, a.headline-link, .card a, [data-testid="title-link"]'
+
+# Resolve relative article links against each site's base URL
+coindesk_url = functools.partial(urljoin, "https://www.coindesk.com/")
+cointelegraph_url = functools.partial(urljoin, "https://cointelegraph.com/")
+
+# Titles of navigation links and other non-article content
+NAV_SKIP_RE = re.compile(r'contact|about us|advertise|sign up|log in', re.IGNORECASE)
+
+# Titles relevant to the channel when scraping general (non-bitcoin) pages
+BITCOIN_RE = re.compile(r'bitcoin|btc|crypto', re.IGNORECASE)
+
+def first_with_text(node, selector):
+    """Return the first element matching selector that has non-empty text"""
+    # css_first stops at the first match, which is usually the one we want
+    elem = node.css_first(selector)
+    if elem is None or elem.text().strip():
+        return elem
+    for elem in node.css(selector):
+        if elem.text().strip():
+            return elem
+    return None
+
+def link_title(link):
+    """Return the title of a link, falling back to the headline next to it"""
+    title = link.text().strip()
+    parent = link.parent
+    if not title and parent:
+        # Prefer a heading, otherwise the first text in the parent rather than all of it
+        title_elem = first_with_text(parent, HEADING_SEL)
+        if title_elem:
+            title = title_elem.text().strip()
+        else:
+            title = next((node.text().strip() for node in parent.traverse(include_text=True)
+                          if node.tag == '-text' and node.text().strip()), '')
+    return title[:MAX_TITLE_LENGTH]
+
+def card_elems(article, title_sel, link_sel):
+    """Return the (title, link) elements of an article card"""
+    title_elem = first_with_text(article, title_sel)
+    # The first link can be an anchor without href, so take the first usable one
+    link_elem = next((elem for elem in article.css(link_sel) if elem.attributes.get('href')), None)
+    if title_elem is None and link_elem is None and article.tag == 'a':
+        # Last resort: the card itself is the link and holds the title
+        return article, article
+    return title_elem, link_elem
+
+def extract_cards(articles, title_sel, link_sel, absolutize, limit=10):
+    """Pre-extract absolute (title, link) pairs from the first article cards"""
+    cards = [card_elems(article, title_sel, link_sel) for article in articles[:limit]]
+    pairs = [(title_elem.text().strip(), link_elem.attributes.get('href'))
+             for title_elem, link_elem in cards
+             if title_elem is not None and link_elem is not None]
+    # Ensure minimum title length and make sure links are absolute
+    return [(title, absolutize(href)) for title, href in pairs if href and len(title) > 10]
+
+@dataclass(slots=True, frozen=True)
+class NewsItem:
+    """A headline scraped from a news source"""
+    title: str
+    link: str
+    source: str
+    hash: int = field(init=False)
+
+    def __post_init__(self):
+        # Signed 64-bit so it fits SQLite's INTEGER column
+        digest = xxhash.xxh3_64_digest(f"{self.title}:{self.link}".encode())
+        object.__setattr__(self, 'hash', int.from_bytes(digest, 'big', signed=True))
+
 class CryptoNewsBot:
     def __init__(self, channel_id):
         self.channel_id = channel_id
         self.application = ApplicationBuilder().token(BOT_TOKEN).build()
-        self.posted_news = self.load_posted_news()
+        self.db = self.open_posted_news_db()
+        self.migrate_legacy_posted_news()
+        self._posted_hashes = set(self.load_posted_news())
+        self._legacy_hashes = set(self.load_legacy_posted_news())
+        self._session = None
+        self._host_failures = {}
+        self._host_skip_until = {}
+        # Telegram allows ~30 messages/s overall and ~1 message/s per chat
+        self._global_limiter = AsyncLimiter(25, 1.0)
+        self._chat_limiter = AsyncLimiter(1, 1.1)
+        # Set by /checknews to wake the scheduler; set when the requested check finishes
+        self._check_requested = asyncio.Event()
+        self._check_completed = asyncio.Event()
+        # Set when the scheduler is cancelled, so waiting requests know no check ran
+        self._scheduler_stopped = False
+
+    async def _get_session(self):
+        """Return the shared HTTP session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=20, limit_per_host=8, ttl_dns_cache=300, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=30),
+                headers=BASE_HEADERS
+            )
+        return self._session
+
+    async def close(self):
+        """Close the shared HTTP session and the posted news database"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self.db.close()
+
+    def open_posted_news_db(self):
+        """Open the posted news database, creating the table and index if needed"""
+        db = sqlite3.connect(POSTED_NEWS_DB)
+        db.execute("CREATE TABLE IF NOT EXISTS posted(hash INTEGER PRIMARY KEY, title TEXT, ts INTEGER)")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_ts ON posted(ts)")
+        # MD5 keys carried over from the JSON file, kept until they expire
+        db.execute("CREATE TABLE IF NOT EXISTS legacy_posted(md5 TEXT PRIMARY KEY, ts INTEGER)")
+        db.commit()
+        return db
+
+    def migrate_legacy_posted_news(self):
+        """Import posted news from the old JSON file into the database"""
+        try:
+            with open(LEGACY_POSTED_NEWS_FILE, 'r') as f:
+                posted_news = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logger.warning(f"{LEGACY_POSTED_NEWS_FILE} is invalid, not migrating it")
+            return
+
+        entries = []
+        for news_hash, data in posted_news.items():
+            try:
+                timestamp = int(datetime.fromisoformat(data['timestamp']).timestamp())
+            except (KeyError, TypeError, ValueError):
+                logger.warning(f"Skipping invalid entry {news_hash} in {LEGACY_POSTED_NEWS_FILE}")
+                continue
+            entries.append((news_hash, timestamp))
+
+        self.db.executemany("INSERT OR IGNORE INTO legacy_posted VALUES (?, ?)", entries)
+        self.db.commit()
+        os.remove(LEGACY_POSTED_NEWS_FILE)
+        logger.info(f"Migrated {len(entries)} posted news entries from {LEGACY_POSTED_NEWS_FILE}")
 
     def load_posted_news(self):
-        """Load previously posted news from file"""
-        try:
-            with open(POSTED_NEWS_FILE, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            logger.info("No existing posted news file found or file is invalid. Creating new tracking.")
-            return {}
-
-    def save_posted_news(self):
-        """Save posted news to file"""
+        """Load hashes of previously posted news from the database"""
+        return [row[0] for row in self.db.execute("SELECT hash FROM posted")]
+
+    def load_legacy_posted_news(self):
+        """Load MD5 keys of news posted before the database was introduced"""
+        return [row[0] for row in self.db.execute("SELECT md5 FROM legacy_posted")]
+
+    def flush_posted_news(self):
+        """Commit the posted news recorded during this cycle in a single transaction"""
         try:
-            with open(POSTED_NEWS_FILE, 'w') as f:
-                json.dump(self.posted_news, f)
-            logger.debug("Successfully saved posted news to file")
+            self.db.commit()
         except Exception as e:
-            logger.error(f"Error saving posted news: {e}")
+            logger.error(f"Error flushing posted news: {e}")
 
     def get_headers(self):
-        """Get random browser-like headers to avoid blocking"""
-        return {
-            'User-Agent': random.choice(USER_AGENTS),
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-            'Sec-Fetch-Dest': 'document',
-            'Sec-Fetch-Mode': 'navigate',
-            'Sec-Fetch-Site': 'none',
-            'Sec-Fetch-User': '?1',
-            'Cache-Control': 'max-age=0'
-        }
+        """Get a random User-Agent header to avoid blocking"""
+        return random.choice(USER_AGENT_HEADERS)
+
+    def _record_host_failure(self, host):
+        """Count a failed request and skip the host for a cycle after too many in a row.
+
+        Returns True if the host is now being skipped.
+        """
+        self._host_failures[host] = self._host_failures.get(host, 0) + 1
+        if self._host_failures[host] < HOST_FAILURE_LIMIT:
+            return False
+
+        logger.warning(f"{host} failed {self._host_failures[host]} times in a row, skipping it for the next check")
+        self._host_failures[host] = 0
+        # Long enough to cover the next scheduled check but not the one after
+        self._host_skip_until[host] = time.monotonic() + NEWS_CHECK_INTERVAL * 1.5
+        return True
+
+    async def fetch_page(self, url, retries=3):
+        """Fetch a page, retrying server errors and timeouts with exponential backoff.
+
+        Returns the response body, or None if the server answered with an error status.
+        """
+        host = urlsplit(url).hostname
+        if time.monotonic() < self._host_skip_until.get(host, 0):
+            logger.warning(f"Skipping {url}, {host} failed repeatedly")
+            return None
+
+        session = await self._get_session()
+        for attempt in range(retries):
+            last_attempt = attempt == retries - 1
+            try:
+                async with session.get(url, headers=self.get_headers()) as response:
+                    if response.status == 200:
+                        self._host_failures[host] = 0
+                        return await response.read()
+
+                    host_skipped = self._record_host_failure(host)
+                    # Client errors won't go away on retry, so fail fast
+                    if response.status < 500 or last_attempt or host_skipped:
+                        logger.warning(f"Failed to fetch {url}, status code: {response.status}")
+                        return None
+                    logger.warning(f"Server error {response.status} fetching {url}, retrying...")
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if self._record_host_failure(host) or last_attempt:
+                    raise
+                logger.warning(f"Error fetching {url}: {e!r}, retrying...")
+
+            await asyncio.sleep(0.5 * 2 ** attempt + random.random() * 0.25)
 
     async def fetch_coindesk_news(self):
         """Fetch news from CoinDesk"""
         news_items = []
-        async with aiohttp.ClientSession() as session:
-            try:
-                logger.info("Fetching news from CoinDesk...")
-                # Try the main Bitcoin tag page
-                headers = self.get_headers()
-                async with session.get("https://www.coindesk.com/tag/bitcoin/", headers=headers, timeout=30) as response:
-                    if response.status == 200:
-                        html = await response.text()
-                        logger.debug(f"Received {len(html)} bytes from CoinDesk")
-
-                        soup = BeautifulSoup(html, 'html.parser')
-
-                        # For debugging - save HTML to file to analyze structure
-                        if logger.level == logging.DEBUG:
-                            with open("coindesk_debug.html", "w", encoding="utf-8") as f:
-                                f.write(html)
-                            logger.debug("Saved CoinDesk HTML to coindesk_debug.html for analysis")
-
-                        # First try standard article tags
-                        articles = soup.select('article')
-
-                        # If no articles found, try other common containers
-                        if not articles:
-                            articles = soup.select('.article-card, .story-card, .post-card, .featured-post, .story-module, .story, .post, .card')
-
-                        logger.info(f"Found {len(articles)} articles on CoinDesk")
-
-                        if not articles:
-                            # Try a different approach - find all links with titles that might be articles
-                            potential_articles = soup.select('a[href*="/bitcoin/"], a[href*="/markets/"]')
-                            logger.info(f"Trying alternative method, found {len(potential_articles)} potential articles")
-
-                            for link in potential_articles[:15]:  # Process top 15 potential articles
-                                try:
-                                    href = link.get('href')
-                                    # Skip if not a proper article link
-                                    if not href or '/tag/' in href or '#' in href:
-                                        continue
-
-                                    # Try to find a title within or near the link
-                                    title_elem = link.find(text=True, recursive=True)
-                                    if not title_elem:
-                                        # Try parent or sibling elements
-                                        parent = link.parent
-                                        title_elem = parent.find(text=True, recursive=True)
-
-                                    title = title_elem.strip() if title_elem else None
-
-                                    # Make sure link is absolute
-                                    if href and not href.startswith('http'):
-                                        href = f"https://www.coindesk.com{href}"
-
-                                    if title and href and len(title) > 15:  # Filter out too short titles
-                                        # Skip navigation links and other non-article content
-                                        if any(skip in title.lower() for skip in ['contact', 'about us', 'advertise', 'sign up', 'log in']):
-                                            continue
-
-                                        news_items.append({
-                                            'title': title,
-                                            'link': href,
-                                            'source': 'CoinDesk'
-                                        })
-                                except Exception as e:
-                                    logger.debug(f"Error processing potential CoinDesk article: {e}")
-                                    continue
-
-                        # Process regular articles if found
-                        for article in articles[:10]:
-                            try:
-                                # Try various title selectors that might match current structure
-                                title_elem = None
-                                for selector in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6', '.headline', '.title', '.card-title', '[data-testid="title"]']:
-                                    title_elem = article.select_one(selector)
-                                    if title_elem and title_elem.text.strip():
-                                        break
-
-                                # Try different link selectors
-                                link_elem = None
-                                for selector in ['a', 'a.headline-link', '.card a', '[data-testid="title-link"]']:
-                                    link_elem = article.select_one(selector)
-                                    if link_elem and link_elem.get('href'):
-                                        break
-
-                                if not title_elem and not link_elem:
-                                    # Last resort: if article has a direct link
-                                    if article.name == 'a' and article.get('href'):
-                                        link_elem = article
-                                        # Try to extract text from the article itself
-                                        title_elem = article
-
-                                # Extract title and link safely
-                                title = title_elem.text.strip() if title_elem else None
-                                link = link_elem.get('href') if link_elem else None
-
-                                # Make sure link is absolute
-                                if link and not link.startswith('http'):
-                                    link = f"https://www.coindesk.com{link}"
-
-                                if title and link and len(title) > 10:  # Ensure minimum title length
-                                    logger.debug(f"Found article: {title[:30]}... - {link}")
-                                    news_items.append({
-                                        'title': title,
-                                        'link': link,
-                                        'source': 'CoinDesk'
-                                    })
-                                else:
-                                    logger.debug(f"Skipping article with missing/invalid title or link")
-                            except Exception as e:
-                                logger.error(f"Error processing CoinDesk article: {e}")
-                                continue
-                    else:
-                        logger.warning(f"Failed to fetch from CoinDesk, status code: {response.status}")
-
-                # If no news found on tag page, try the main markets page
-                if not news_items:
-                    logger.info("Trying CoinDesk markets page...")
-                    headers = self.get_headers()  # Get fresh headers
-                    async with session.get("https://www.coindesk.com/markets/", headers=headers, timeout=30) as response:
-                        if response.status == 200:
-                            html = await response.text()
-                            logger.debug(f"Received {len(html)} bytes from CoinDesk markets page")
-
-                            soup = BeautifulSoup(html, 'html.parser')
-
-                            # Try various container selectors
-                            articles = soup.select('article, .article-card, .story-card, .post-card, .card')
-                            logger.info(f"Found {len(articles)} articles on CoinDesk markets page")
-
-                            for article in articles[:10]:
-                                try:
-                                    # Extract title and link using same logic as above
-                                    title_elem = None
-                                    for selector in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6', '.headline', '.title', '.card-title']:
-                                        title_elem = article.select_one(selector)
-                                        if title_elem and title_elem.text.strip():
-                                            break
-
-                                    link_elem = article.select_one('a')
-
-                                    title = title_elem.text.strip() if title_elem else None
-                                    link = link_elem.get('href') if link_elem else None
-
-                                    # Make sure link is absolute
-                                    if link and not link.startswith('http'):
-                                        link = f"https://www.coindesk.com{link}"
-
-                                    if title and link and len(title) > 10:
-                                        # Only add bitcoin-related news
-                                        title_lower = title.lower()
-                                        if 'bitcoin' in title_lower or 'btc' in title_lower or 'crypto' in title_lower:
-                                            news_items.append({
-                                                'title': title,
-                                                'link': link,
-                                                'source': 'CoinDesk'
-                                            })
-                                except Exception as e:
-                                    logger.error(f"Error processing CoinDesk markets article: {e}")
-                                    continue
-                        else:
-                            logger.warning(f"Failed to fetch from CoinDesk markets page, status code: {response.status}")
-            except aiohttp.ClientError as e:
-                logger.error(f"Network error fetching CoinDesk news: {e}")
-            except Exception as e:
-                logger.error(f"Unexpected error fetching CoinDesk news: {e}")
-                logger.error(traceback.format_exc())
+        try:
+            logger.info("Fetching news from CoinDesk...")
+            # Try the main Bitcoin tag page
+            html = await self.fetch_page("https://www.coindesk.com/tag/bitcoin/")
+            if html is not None:
+                logger.debug("Received %d bytes from CoinDesk", len(html))
+
+                # For debugging - save HTML to file to analyze structure
+                if logger.isEnabledFor(logging.DEBUG):
+                    await asyncio.to_thread(Path("coindesk_debug.html").write_bytes, html)
+                    logger.debug("Saved CoinDesk HTML to coindesk_debug.html for analysis")
+
+                # Parse off the event loop so the bot stays responsive
+                news_items = await asyncio.to_thread(self._parse_coindesk, html)
+
+            # If no news found on tag page, try the main markets page
+            if not news_items:
+                logger.info("Trying CoinDesk markets page...")
+                html = await self.fetch_page("https://www.coindesk.com/markets/")
+                if html is not None:
+                    logger.debug("Received %d bytes from CoinDesk markets page", len(html))
+
+                    news_items = await asyncio.to_thread(self._parse_coindesk_markets, html)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Network error fetching CoinDesk news: {e!r}")
+        except Exception:
+            logger.exception("Unexpected error fetching CoinDesk news")
 
         logger.info(f"Retrieved {len(news_items)} news items from CoinDesk")
         return news_items
@@ -249,257 +315,291 @@ class CryptoNewsBot:
     async def fetch_cointelegraph_news(self):
         """Fetch news from CoinTelegraph"""
         news_items = []
-        async with aiohttp.ClientSession() as session:
-            try:
-                logger.info("Fetching news from CoinTelegraph...")
-                # Add user-agent and other headers to mimic browser
-                headers = self.get_headers()
-                async with session.get("https://cointelegraph.com/tags/bitcoin", headers=headers, timeout=30) as response:
-                    if response.status == 200:
-                        html = await response.text()
-                        logger.debug(f"Received {len(html)} bytes from CoinTelegraph")
-
-                        soup = BeautifulSoup(html, 'html.parser')
-
-                        # For debugging - save HTML to file
-                        if logger.level == logging.DEBUG:
-                            with open("cointelegraph_debug.html", "w", encoding="utf-8") as f:
-                                f.write(html)
-                            logger.debug("Saved CoinTelegraph HTML to cointelegraph_debug.html for analysis")
-
-                        # Try different article selectors
-                        articles = soup.select('.post-card-inline, .post-card, article, .posts-listing__item')
-
-                        # If nothing found, try more generic selectors
-                        if not articles:
-                            articles = soup.select('.card, .news-item, .article, .post, .story')
-
-                        logger.info(f"Found {len(articles)} articles on CoinTelegraph")
-
-                        if not articles:
-                            # Try alternative approach - find main list containers
-                            containers = soup.select('.posts-listing, .articles-list, .news-feed, main, .content')
-
-                            if containers:
-                                # Extract links from containers that might be articles
-                                for container in containers:
-                                    links = container.select('a[href*="/news/"], a[href*="/bitcoin/"]')
-                                    logger.info(f"Found {len(links)} potential article links in container")
-
-                                    for link in links[:15]:
-                                        try:
-                                            href = link.get('href')
-
-                                            # Skip navigation links
-                                            if not href or '/tags/' in href or '#' in href:
-                                                continue
-
-                                            # Try to find title
-                                            title = None
-
-                                            # First look for title in link text
-                                            if link.text and link.text.strip():
-                                                title = link.text.strip()
-
-                                            # If no title in link text, try child elements
-                                            if not title:
-                                                title_elem = link.select_one('h1, h2, h3, h4, h5, h6, .title, .heading')
-                                                if title_elem:
-                                                    title = title_elem.text.strip()
-
-                                            # If still no title, look in parent elements
-                                            if not title:
-                                                parent = link.parent
-                                                title_elem = parent.select_one('h1, h2, h3, h4, h5, h6, .title, .heading')
-                                                if title_elem:
-                                                    title = title_elem.text.strip()
-
-                                            # Make sure link is absolute
-                                            if href and not href.startswith('http'):
-                                                href = f"https://cointelegraph.com{href}"
-
-                                            if title and href and len(title) > 15:
-                                                # Skip navigation and non-article content
-                                                if any(skip in title.lower() for skip in ['contact', 'about us', 'advertise', 'sign up', 'log in']):
-                                                    continue
-
-                                                news_items.append({
-                                                    'title': title,
-                                                    'link': href,
-                                                    'source': 'CoinTelegraph'
-                                                })
-                                        except Exception as e:
-                                            logger.debug(f"Error processing potential CoinTelegraph article link: {e}")
-                                            continue
-
-                        # Process regular articles if found
-                        for article in articles[:10]:
-                            try:
-                                # Try different title selectors
-                                title_elem = None
-                                for selector in ['.post-card-inline__title', '.post-card__title', 'h1', 'h2', 'h3', 'h4', '.title', '.headline']:
-                                    title_elem = article.select_one(selector)
-                                    if title_elem and title_elem.text.strip():
-                                        break
-
-                                # Try to find link
-                                link_elem = article.select_one('a')
-
-                                # Extract title and link safely
-                                title = title_elem.text.strip() if title_elem else None
-                                link = link_elem.get('href') if link_elem else None
-
-                                # Make sure link is absolute
-                                if link and not link.startswith('http'):
-                                    link = f"https://cointelegraph.com{link}"
-
-                                if title and link and len(title) > 10:
-                                    logger.debug(f"Found article: {title[:30]}... - {link}")
-                                    news_items.append({
-                                        'title': title,
-                                        'link': link,
-                                        'source': 'CoinTelegraph'
-                                    })
-                                else:
-                                    logger.debug(f"Skipping article with missing/invalid title or link")
-                            except Exception as e:
-                                logger.error(f"Error processing CoinTelegraph article: {e}")
-                                continue
-                    else:
-                        logger.warning(f"Failed to fetch from CoinTelegraph, status code: {response.status}")
-
-                # If no articles found or access was denied, try the homepage as fallback
-                if not news_items or response.status == 403:
-                    logger.info("Trying CoinTelegraph homepage as fallback...")
-                    # Get fresh headers and add a delay to avoid detection
-                    await asyncio.sleep(2)
-                    headers = self.get_headers()
-                    async with session.get("https://cointelegraph.com/", headers=headers, timeout=30) as response:
-                        if response.status == 200:
-                            html = await response.text()
-                            logger.debug(f"Received {len(html)} bytes from CoinTelegraph homepage")
-
-                            soup = BeautifulSoup(html, 'html.parser')
-
-                            # Find all news items on homepage
-                            articles = soup.select('article, .post-card, .news-card, .article-card')
-                            logger.info(f"Found {len(articles)} articles on CoinTelegraph homepage")
-
-                            for article in articles[:10]:
-                                try:
-                                    title_elem = article.select_one('h1, h2, h3, h4, h5, h6, .title', '.headline')
-                                    link_elem = article.select_one('a')
-
-                                    title = title_elem.text.strip() if title_elem else None
-                                    link = link_elem.get('href') if link_elem else None
-
-                                    # Make sure link is absolute
-                                    if link and not link.startswith('http'):
-                                        link = f"https://cointelegraph.com{link}"
-
-                                    if title and link and len(title) > 10:
-                                        # Only add bitcoin-related news
-                                        title_lower = title.lower()
-                                        if 'bitcoin' in title_lower or 'btc' in title_lower or 'crypto' in title_lower:
-                                            news_items.append({
-                                                'title': title,
-                                                'link': link,
-                                                'source': 'CoinTelegraph'
-                                            })
-                                except Exception as e:
-                                    logger.error(f"Error processing CoinTelegraph homepage article: {e}")
-                                    continue
-                        else:
-                            logger.warning(f"Failed to fetch from CoinTelegraph homepage, status code: {response.status}")
-            except aiohttp.ClientError as e:
-                logger.error(f"Network error fetching CoinTelegraph news: {e}")
-            except Exception as e:
-                logger.error(f"Unexpected error fetching CoinTelegraph news: {e}")
-                logger.error(traceback.format_exc())
+        try:
+            logger.info("Fetching news from CoinTelegraph...")
+            html = await self.fetch_page("https://cointelegraph.com/tags/bitcoin")
+            if html is not None:
+                logger.debug("Received %d bytes from CoinTelegraph", len(html))
+
+                # For debugging - save HTML to file
+                if logger.isEnabledFor(logging.DEBUG):
+                    await asyncio.to_thread(Path("cointelegraph_debug.html").write_bytes, html)
+                    logger.debug("Saved CoinTelegraph HTML to cointelegraph_debug.html for analysis")
+
+                # Parse off the event loop so the bot stays responsive
+                news_items = await asyncio.to_thread(self._parse_cointelegraph, html)
+
+            # If no articles found or access was denied, try the homepage as fallback
+            if not news_items:
+                logger.info("Trying CoinTelegraph homepage as fallback...")
+                # Add a delay to avoid detection
+                await asyncio.sleep(2)
+                html = await self.fetch_page("https://cointelegraph.com/")
+                if html is not None:
+                    logger.debug("Received %d bytes from CoinTelegraph homepage", len(html))
+
+                    news_items = await asyncio.to_thread(self._parse_cointelegraph_homepage, html)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Network error fetching CoinTelegraph news: {e!r}")
+        except Exception:
+            logger.exception("Unexpected error fetching CoinTelegraph news")
 
         logger.info(f"Retrieved {len(news_items)} news items from CoinTelegraph")
         return news_items
 
-    # Other methods (is_news_posted, mark_as_posted, clean_old_posts, etc.) remain the same
-    def is_news_posted(self, news_item):
-        """Check if news has been posted before by creating a unique hash"""
-        try:
-            if not isinstance(news_item, dict) or 'title' not in news_item or 'link' not in news_item:
-                logger.error(f"Invalid news item format: {news_item}")
-                return True  # Skip invalid items
+    def _parse_coindesk(self, html):
+        """Parse articles from the CoinDesk bitcoin tag page"""
+        news_items = []
+        tree = LexborHTMLParser(html)
 
-            news_hash = hashlib.md5(f"{news_item['title']}:{news_item['link']}".encode()).hexdigest()
-            return news_hash in self.posted_news
-        except Exception as e:
-            logger.error(f"Error checking if news is posted: {e}")
-            return True  # Assume it's posted if there's an error
+        # First try standard article tags
+        articles = tree.css('article')
+
+        # If no articles found, try other common containers
+        if not articles:
+            articles = tree.css('.article-card, .story-card, .post-card, .featured-post, .story-module, .story, .post, .card')
+
+        logger.info(f"Found {len(articles)} articles on CoinDesk")
+
+        if not articles:
+            # Try a different approach - find all links with titles that might be articles
+            potential_articles = tree.css('a[href*="/bitcoin/"], a[href*="/markets/"]')
+            logger.info(f"Trying alternative method, found {len(potential_articles)} potential articles")
+
+            for link in potential_articles[:15]:  # Process top 15 potential articles
+                href = link.attributes.get('href')
+                # Skip if not a proper article link
+                if not href or '/tag/' in href or '#' in href:
+                    continue
+
+                # Try to find a title within or near the link
+                title = link_title(link)
+
+                # Filter out too short titles and navigation links
+                if len(title) > 15 and not NAV_SKIP_RE.search(title):
+                    news_items.append(NewsItem(title, coindesk_url(href), 'CoinDesk'))
+
+        # Process regular articles if found
+        cards = extract_cards(articles, TITLE_SEL, LINK_SEL, coindesk_url)
+        logger.debug("Kept %d CoinDesk article cards", len(cards))
+        news_items.extend(NewsItem(title, link, 'CoinDesk') for title, link in cards)
+
+        return news_items
+
+    def _parse_coindesk_markets(self, html):
+        """Parse bitcoin-related articles from the CoinDesk markets page"""
+        news_items = []
+        tree = LexborHTMLParser(html)
+
+        # Try various container selectors
+        articles = tree.css('article, .article-card, .story-card, .post-card, .card')
+        logger.info(f"Found {len(articles)} articles on CoinDesk markets page")
+
+        # Only add bitcoin-related news
+        cards = extract_cards(articles, TITLE_SEL, 'a', coindesk_url)
+        news_items.extend(NewsItem(title, link, 'CoinDesk')
+                          for title, link in cards if BITCOIN_RE.search(title))
+
+        return news_items
+
+    def _parse_cointelegraph(self, html):
+        """Parse articles from the CoinTelegraph bitcoin tag page"""
+        news_items = []
+        tree = LexborHTMLParser(html)
+
+        # Try different article selectors
+        articles = tree.css('.post-card-inline, .post-card, article, .posts-listing__item')
+
+        # If nothing found, try more generic selectors
+        if not articles:
+            articles = tree.css('.card, .news-item, .article, .post, .story')
+
+        logger.info(f"Found {len(articles)} articles on CoinTelegraph")
+
+        if not articles:
+            # Try alternative approach - find main list containers
+            containers = tree.css('.posts-listing, .articles-list, .news-feed, main, .content')
+
+            if containers:
+                # Extract links from containers that might be articles
+                for container in containers:
+                    links = container.css('a[href*="/news/"], a[href*="/bitcoin/"]')
+                    logger.info(f"Found {len(links)} potential article links in container")
+
+                    for link in links[:15]:
+                        href = link.attributes.get('href')
+
+                        # Skip navigation links
+                        if not href or '/tags/' in href or '#' in href:
+                            continue
+
+                        # Look for title in link text first (this includes any child headings), then around it
+                        title = link_title(link)
+
+                        # Filter out too short titles and non-article content
+                        if len(title) > 15 and not NAV_SKIP_RE.search(title):
+                            news_items.append(NewsItem(title, cointelegraph_url(href), 'CoinTelegraph'))
+
+        # Process regular articles if found
+        cards = extract_cards(articles, COINTELEGRAPH_TITLE_SEL, 'a', cointelegraph_url)
+        logger.debug("Kept %d CoinTelegraph article cards", len(cards))
+        news_items.extend(NewsItem(title, link, 'CoinTelegraph') for title, link in cards)
+
+        return news_items
+
+    def _parse_cointelegraph_homepage(self, html):
+        """Parse bitcoin-related articles from the CoinTelegraph homepage"""
+        news_items = []
+        tree = LexborHTMLParser(html)
+
+        # Find all news items on homepage
+        articles = tree.css('article, .post-card, .news-card, .article-card')
+        logger.info(f"Found {len(articles)} articles on CoinTelegraph homepage")
+
+        # Only add bitcoin-related news
+        cards = extract_cards(articles, TITLE_SEL, 'a', cointelegraph_url)
+        news_items.extend(NewsItem(title, link, 'CoinTelegraph')
+                          for title, link in cards if BITCOIN_RE.search(title))
+
+        return news_items
+
+    def is_news_posted(self, news_item):
+        """Check if a news item has been posted before"""
+        if news_item.hash in self._posted_hashes:
+            return True
+        # News posted before the database existed is keyed by the old MD5 hash
+        if not self._legacy_hashes:
+            return False
+        legacy_hash = hashlib.md5(f"{news_item.title}:{news_item.link}".encode()).hexdigest()
+        return legacy_hash in self._legacy_hashes
 
     def mark_as_posted(self, news_item):
         """Mark a news item as posted"""
         try:
-            news_hash = hashlib.md5(f"{news_item['title']}:{news_item['link']}".encode()).hexdigest()
-            self.posted_news[news_hash] = {
-                'title': news_item['title'],
-                'timestamp': datetime.now().isoformat()
-            }
-            self.save_posted_news()
+            news_hash = news_item.hash
+            self._posted_hashes.add(news_hash)
+            # Committed by flush_posted_news() at the end of the cycle
+            self.db.execute(
+                "INSERT OR IGNORE INTO posted VALUES (?, ?, ?)",
+                (news_hash, news_item.title, int(time.time()))
+            )
         except Exception as e:
             logger.error(f"Error marking news as posted: {e}")
 
     def clean_old_posts(self, days=7):
         """Remove posts older than specified days"""
         try:
-            now = datetime.now()
-            to_remove = []
-
-            for news_hash, data in self.posted_news.items():
-                try:
-                    if not isinstance(data, dict) or 'timestamp' not in data:
-                        # Fix corrupted entries
-                        to_remove.append(news_hash)
-                        continue
-
-                    post_time = datetime.fromisoformat(data['timestamp'])
-                    if now - post_time > timedelta(days=days):
-                        to_remove.append(news_hash)
-                except (ValueError, KeyError) as e:
-                    logger.warning(f"Error processing post {news_hash}: {e}")
-                    to_remove.append(news_hash)
-
-            for news_hash in to_remove:
-                self.posted_news.pop(news_hash, None)
-
-            if to_remove:
-                self.save_posted_news()
-                logger.info(f"Cleaned {len(to_remove)} old posts")
+            cutoff = int(time.time()) - days * 86400
+            removed = self.db.execute("DELETE FROM posted WHERE ts < ?", (cutoff,)).rowcount
+            removed_legacy = self.db.execute("DELETE FROM legacy_posted WHERE ts < ?", (cutoff,)).rowcount
+            self.db.commit()
+
+            if removed:
+                self._posted_hashes = set(self.load_posted_news())
+            if removed_legacy:
+                self._legacy_hashes = set(self.load_legacy_posted_news())
+            if removed or removed_legacy:
+                logger.info(f"Cleaned {removed + removed_legacy} old posts")
         except Exception as e:
             logger.error(f"Error cleaning old posts: {e}")
 
-    async def post_news_to_channel(self, news_item):
-        """Post a news item to the Telegram channel"""
-        if not isinstance(news_item, dict) or 'title' not in news_item or 'source' not in news_item or 'link' not in news_item:
-            logger.error(f"Invalid news item format for posting: {news_item}")
-            return False
-
-        message = f"📢 *{news_item['source']}* 📢\n\n" \
-                 f"*{news_item['title']}*\n\n" \
-                 f"[Read more]({news_item['link']})"
+    async def send_to_channel(self, message):
+        """Send a message to the channel within Telegram's rate limits, waiting out flood control once"""
+        for attempt in range(2):
+            try:
+                # ZMIANA 2: Użycie self.channel_id, które jest poprawnie ustawione
+                async with self._global_limiter, self._chat_limiter:
+                    await self.application.bot.send_message(
+                        chat_id=self.channel_id,
+                        text=message,
+                        parse_mode=telegram.constants.ParseMode.MARKDOWN_V2,
+                        disable_web_page_preview=True
+                    )
+                return
+            except telegram.error.RetryAfter as e:
+                if attempt:
+                    raise
+                retry_after = e.retry_after
+                # Releases before 22.2 still return plain seconds
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                logger.warning(f"Flood control exceeded, retrying in {retry_after} seconds")
+                await asyncio.sleep(retry_after)
+
+    def format_news(self, news_item):
+        """Format a news item as a MarkdownV2 post"""
+        # Escape scraped text so a stray markup character can't get the message rejected
+        escape = telegram.helpers.escape_markdown
+        return (
+            f"📢 *{escape(news_item.source, version=2)}* 📢\n\n"
+            f"*{escape(news_item.title, version=2)}*\n\n"
+            f"[Read more]({escape(news_item.link, version=2, entity_type='text_link')})"
+        )
+
+    async def post_news_to_channel(self, news_batch):
+        """Post a batch of news items to the Telegram channel as one message"""
+        if not news_batch:
+            return 0
+
+        message = "\n\n".join(self.format_news(news_item) for news_item in news_batch)
 
         try:
-            # ZMIANA 2: Użycie self.channel_id, które jest poprawnie ustawione
-            await self.application.bot.send_message(
-                chat_id=self.channel_id,
-                text=message,
-                parse_mode=telegram.constants.ParseMode.MARKDOWN,
-                disable_web_page_preview=True
-            )
-            logger.info(f"Posted news: {news_item['title']}")
+            await self.send_to_channel(message)
+        except telegram.error.BadRequest as e:
+            if len(news_batch) == 1:
+                logger.error(f"Telegram rejected news item {news_batch[0].title!r}: {e}")
+                return 0
+            # Post the items one by one so a single bad item can't hold back the rest
+            logger.warning(f"Telegram rejected batch of {len(news_batch)} news items ({e}), posting them separately")
+            posts_count = 0
+            for news_item in news_batch:
+                posts_count += await self.post_news_to_channel([news_item])
+            return posts_count
+        except Exception:
+            logger.exception("Error posting to channel")
+            return 0
+
+        for news_item in news_batch:
+            logger.info(f"Posted news: {news_item.title}")
             self.mark_as_posted(news_item)
-            return True
+        return len(news_batch)
+
+    async def _produce_news(self, queue, fetch_news, source):
+        """Fetch news from one source and feed the items to the queue"""
+        try:
+            for news_item in await fetch_news():
+                await queue.put(news_item)
         except Exception as e:
-            logger.error(f"Error posting to channel: {e}")
-            logger.error(traceback.format_exc())
-            return False
+            logger.error(f"Error fetching {source} news: {e}")
+        finally:
+            # Tell the consumer this source is done
+            await queue.put(None)
+
+    async def _consume_and_post(self, queue, producers):
+        """Post new headlines from each source as soon as that source is done"""
+        posts_count = 0
+        news_batch = []
+        seen_hashes = set()
+        finished = 0
+
+        while finished < producers:
+            news_item = await queue.get()
+            if news_item is None:
+                finished += 1
+                posts_count += await self.post_news_to_channel(news_batch)
+                news_batch = []
+                continue
+
+            # Limit to posting MAX_POSTS_PER_CHECK news items at once
+            if posts_count + len(news_batch) >= MAX_POSTS_PER_CHECK:
+                continue
+
+            if news_item.hash in seen_hashes or self.is_news_posted(news_item):
+                continue
+            seen_hashes.add(news_item.hash)
+            news_batch.append(news_item)
+
+        return posts_count
 
     async def check_and_post_news(self):
         """Check for new crypto news and post them"""
@@ -507,70 +607,62 @@ class CryptoNewsBot:
             # Clean old posts periodically
             self.clean_old_posts()
 
-            # Fetch news from different sources
-            coindesk_news = await self.fetch_coindesk_news()
-            cointelegraph_news = await self.fetch_cointelegraph_news()
-
-            # Validate news items are in correct format
-            valid_coindesk_news = []
-            valid_cointelegraph_news = []
-
-            for news in coindesk_news:
-                if isinstance(news, dict) and all(k in news for k in ['title', 'link', 'source']):
-                    valid_coindesk_news.append(news)
-                else:
-                    logger.warning(f"Invalid news item format from CoinDesk: {news}")
-
-            for news in cointelegraph_news:
-                if isinstance(news, dict) and all(k in news for k in ['title', 'link', 'source']):
-                    valid_cointelegraph_news.append(news)
-                else:
-                    logger.warning(f"Invalid news item format from CoinTelegraph: {news}")
-
-            # Combine news from all sources
-            all_news = valid_coindesk_news + valid_cointelegraph_news
-            logger.info(f"Total valid news items: {len(all_news)}")
+            # Fetch from all sources concurrently and post while fetching is still in progress
+            queue = asyncio.Queue(maxsize=64)
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(self._produce_news(queue, self.fetch_coindesk_news, 'CoinDesk'))
+                tg.create_task(self._produce_news(queue, self.fetch_cointelegraph_news, 'CoinTelegraph'))
+                consumer = tg.create_task(self._consume_and_post(queue, producers=2))
 
-            # Post only new news
-            posts_count = 0
-            for news_item in all_news:
-                if not self.is_news_posted(news_item):
-                    success = await self.post_news_to_channel(news_item)
-                    if success:
-                        posts_count += 1
-                    # Add a small delay between posts to avoid flooding
-                    await asyncio.sleep(2)
-
-                    # Limit to posting maximum 5 news items at once
-                    if posts_count >= 5:
-                        break
-
-            logger.info(f"Posted {posts_count} new news items")
-        except Exception as e:
-            logger.error(f"Error in check_and_post_news: {e}")
-            logger.error(traceback.format_exc())
+            logger.info(f"Posted {consumer.result()} new news items")
+        except Exception:
+            logger.exception("Error in check_and_post_news")
+        finally:
+            # Persist everything posted this cycle in one write
+            self.flush_posted_news()
 
     async def cmd_check_news(self, update, context):
         """Handler for /checknews command"""
         try:
             await update.message.reply_text("Checking for new crypto news...")
-            await self.check_and_post_news()
+            # Let the scheduler run the check so manual and scheduled checks never overlap
+            check_completed = self._check_completed
+            self._check_requested.set()
+            await check_completed.wait()
+            if self._scheduler_stopped:
+                await update.message.reply_text("The bot is shutting down, news check was not completed.")
+                return
             await update.message.reply_text("News check completed!")
         except Exception as e:
             logger.error(f"Error handling checknews command: {e}")
             await update.message.reply_text("An error occurred while checking news. Please check the logs.")
 
     async def scheduled_news_check(self):
-        """Periodically check for news"""
-        while True:
-            try:
-                logger.info("Running scheduled news check...")
-                await self.check_and_post_news()
-                logger.info(f"Next check in {NEWS_CHECK_INTERVAL} seconds")
-            except Exception as e:
-                logger.error(f"Error in scheduled news check: {e}")
+        """Check for news every NEWS_CHECK_INTERVAL seconds or as soon as a check is requested"""
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._check_requested.wait(), timeout=NEWS_CHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._check_requested.clear()
 
-            await asyncio.sleep(NEWS_CHECK_INTERVAL)
+                # Requests arriving from now on wait for the next check
+                check_completed = self._check_completed
+                self._check_completed = asyncio.Event()
+                try:
+                    logger.info("Running scheduled news check...")
+                    await self.check_and_post_news()
+                    logger.info(f"Next check in {NEWS_CHECK_INTERVAL} seconds")
+                except Exception as e:
+                    logger.error(f"Error in scheduled news check: {e}")
+                finally:
+                    check_completed.set()
+        except asyncio.CancelledError:
+            # Shutting down: release /checknews requests still waiting for a check
+            self._scheduler_stopped = True
+            self._check_completed.set()
+            raise
 
 async def main():
     # Check if the token is set
@@ -615,15 +707,25 @@ async def main():
         logger.info("Starting scheduled news checks...")
         news_check_task = asyncio.create_task(bot.scheduled_news_check())
 
-        # Keep the program running
-        while True:
-            await asyncio.sleep(60)
+        # Stop on SIGINT/SIGTERM without waking the event loop while idle.
+        # Installed only now so Ctrl+C still interrupts startup and the initial check.
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                # Not supported on Windows; Ctrl+C still raises KeyboardInterrupt there
+                pass
+
+        # Keep the program running until asked to stop
+        await stop_event.wait()
+        logger.info("Bot stopping...")
 
     except (KeyboardInterrupt, SystemExit):
         logger.info("Bot stopping...")
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        logger.error(traceback.format_exc())
+    except Exception:
+        logger.exception("Unexpected error")
     finally:
         # Clean up
         try:
@@ -641,6 +743,10 @@ async def main():
                     await bot.application.updater.stop()
                 await bot.application.stop()
                 await bot.application.shutdown()
+
+            # Persist any pending posts, then close the HTTP session and database
+            bot.flush_posted_news()
+            await bot.close()
         except Exception as e:
             logger.error(f"Error during shutdown: {e}")
 